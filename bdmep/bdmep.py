@@ -1,9 +1,150 @@
-from modals import Station, Attribute, AttrAliases
+from .modals import Station, Attribute, AttrAliases
 from unidecode import unidecode
 import requests
-from urllib.parse import urljoin
-import posixpath
+from requests.adapters import HTTPAdapter
+from requests_cache import CachedSession
+from urllib3.util.retry import Retry
 import re
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from functools import cached_property, lru_cache
+from datetime import datetime, timedelta
+import random
+import logging
+import threading
+from typing import Iterator
+
+try:
+    from orjson import loads as _loads
+except ImportError:
+    from json import loads as _loads
+
+logger = logging.getLogger(__name__)
+
+
+#: Connect and read timeouts, in seconds, used for every request to the API.
+TIMEOUT = (3.05, 30)
+#: How long attribute and station metadata is kept in the on-disk cache.
+CACHE_EXPIRE_AFTER = timedelta(hours=12)
+
+# Selector patterns
+_ATTR_CODE_RE = re.compile(r"^I\d{3}$", flags=re.I)
+_ST_CODE_RE = re.compile(r"^[A-Z]\d{3}$", flags=re.I)
+_CITY_STATE_RE = re.compile(r"^([ a-z]+)[^a-z]?([A-Z]{2})$", flags=re.I)
+# Accented characters found in station names
+_ACCENT_TABLE = str.maketrans("ÁÀÃÂÉÊÍÓÔÕÚÜÇáàãâéêíóôõúüç", "AAAAEEIOOOUUCaaaaeeiooouuc")
+
+
+def _make_session(cache_name: str = "bdmep", use_cache_dir: bool = True) -> requests.Session:
+    """Creates a session that keeps connections to the INMET hosts alive between requests.
+
+    GET responses are cached on disk (in the user cache directory), so metadata fetched by a
+    previous run is reused until it expires. Cache-Control and Expires headers sent by the API
+    take precedence over CACHE_EXPIRE_AFTER, and expired responses carrying an ETag or
+    Last-Modified header are revalidated with a conditional GET. Other methods are never cached.
+
+    :param cache_name: Name of the SQLite cache file, or its path if use_cache_dir is False.
+    :param use_cache_dir: Whether to place the cache file in the user cache directory.
+    """
+
+    session = CachedSession(
+        cache_name,
+        backend="sqlite",
+        use_cache_dir=use_cache_dir,
+        expire_after=CACHE_EXPIRE_AFTER,
+        allowable_methods=("GET",),
+        cache_control=True,
+        stale_if_error=True,
+    )
+    # Retry-After headers sent with 429/503 responses are honored by Retry.
+    retry = Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("https://apitempo.inmet.gov.br", adapter)
+    session.mount("https://apibdmep.inmet.gov.br", adapter)
+    return session
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _get_session() -> requests.Session:
+    """Returns the shared session, creating it on first use rather than at import time."""
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _make_session()
+    return _session
+
+
+def _expire_after() -> timedelta:
+    # Jitter the TTL by up to an hour so cached entries don't all expire at once.
+    return CACHE_EXPIRE_AFTER + timedelta(seconds=random.randint(0, 3600))
+
+
+@lru_cache(maxsize=2048)
+def _to_ascii(text: str) -> str:
+    """Strips the accents from text, falling back to unidecode for uncommon characters."""
+
+    text = text.translate(_ACCENT_TABLE)
+    if not text.isascii():
+        text = unidecode(text)
+    return text
+
+
+# url -> (expiry of the backing HTTP cache entry, decoded body)
+_json_memo: dict[str, tuple[datetime or None, list[dict]]] = {}
+
+
+def _cache_expiry(r: requests.Response) -> datetime or None:
+    # Responses fetched from the network don't carry the expiry the cache assigned them, so it
+    # is read back from the stored entry. None means the entry never expires.
+    if r.from_cache:
+        return r.expires
+    cached = _get_session().cache.get_response(r.cache_key)
+    return cached.expires if cached is not None else datetime.utcnow()
+
+
+def _get_json(url: str) -> list[dict]:
+    """GETs url and returns the decoded JSON body.
+
+    The decoded body is memoized per URL until the HTTP cache entry it came from expires, so
+    repeated queries skip both the request and the decoding, while expiry, Cache-Control and
+    revalidation still apply to long-running processes. Callers must not mutate the returned
+    value.
+    """
+
+    if url in _json_memo:
+        expires, value = _json_memo[url]
+        if expires is None or datetime.utcnow() < expires:
+            return value
+
+    logger.debug("GET request: %s", url)
+    r = _get_session().get(url, timeout=TIMEOUT, expire_after=_expire_after())
+    r.raise_for_status()
+    try:
+        value = _loads(r.content)
+    except ValueError:
+        logger.warning("Invalid JSON response from %s: %.200s", url, r.text)
+        # The body was already stored by the HTTP cache; drop it so the next query refetches.
+        _get_session().cache.delete(r.cache_key)
+        raise
+    _json_memo[url] = (_cache_expiry(r), value)
+    return value
+
+
+class _cached_if_complete(cached_property):
+    # A cached_property that only keeps its value on the instance once no region has been
+    # skipped, so results built from a partial nationwide query are recomputed on next access.
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = self.func(instance)
+        if not instance._skipped_regions:
+            instance.__dict__[self.attrname] = value
+        return value
 
 
 class BDmep:
@@ -15,6 +156,10 @@ class BDmep:
     st_types = ["automatic", "conventional"]
     #: North, northeast, south, southeast, midwest.
     regions = ["n", "no", "s", "su", "co"]
+    # Sets for validating the parameters above
+    _frequency_set = frozenset(frequencies)
+    _st_type_set = frozenset(st_types)
+    _region_set = frozenset(regions)
     # API base urls
     #: Base URL for retrieving attribute information.
     base_apitempo = "https://apitempo.inmet.gov.br/BNDMET/atributos/"
@@ -22,115 +167,171 @@ class BDmep:
     base_apibdmep = "https://apibdmep.inmet.gov.br/"
 
     def __init__(self, freq: str, st_type: str, region: str = None):
-        if freq.lower() not in BDmep.frequencies:
+        freq = freq.lower()
+        st_type = st_type.lower()
+        region = region.lower() if region is not None else None
+        if freq not in BDmep._frequency_set:
             raise ValueError(f"Invalid frequency type. Expected one of: {BDmep.frequencies}")
-        if st_type.lower() not in BDmep.st_types:
+        if st_type not in BDmep._st_type_set:
             raise ValueError(f"Invalid station type. Expected one of: {BDmep.st_types}")
-        if region is not None and region.lower() not in BDmep.regions:
+        if region is not None and region not in BDmep._region_set:
             raise ValueError(f"Invalid region. Expected one of: {BDmep.regions}")
         self.freq = freq
         self.st_type = st_type
         self.region = region
+        # Regions left out of the last nationwide query because of an invalid response
+        self._skipped_regions = []
 
-    @property
+    @cached_property
     def attributes(self) -> list[Attribute]:
         """Queries the attributes according to frequency and station from the API.
 
+        The query happens on first access and its result is kept on the instance.
+
         :return: A list of bdmep.modals.Attribute objects representing the attributes.
         :rtype: list[Attribute]
         """
 
-        freq_frag = self.freq.upper()
-        st_frag = "A301" if self.st_type == "automatic" else "83377"
-        path = posixpath.join(st_frag, freq_frag)
-        url = urljoin(BDmep.base_apitempo, path)
-        print(f"DEBUG: GET request: {url}")
-        r = requests.get(url)
-        r.raise_for_status()
-        return [Attribute.from_dict(attribute) for attribute in r.json()]
+        return Attribute.from_records(self._attr_entries)
 
-    @property
+    @_cached_if_complete
     def stations(self) -> list[Station]:
         """Queries the stations according to station type and region from the API.
 
+        The query happens on first access and its result is kept on the instance. If a region
+        returned an invalid response it is left out, and the query is retried on next access.
+
         :return: A list of bdmep.modals.Station objects representing the stations.
         :rtype: list[Station]
         """
 
-        st_frag = "T/R" if self.st_type == "automatic" else "M/R"
+        return Station.from_records(self._station_entries)
+
+    def iter_stations(self) -> Iterator[Station]:
+        """Lazily yields the stations according to station type and region from the API.
+
+        :return: An iterator of bdmep.modals.Station objects representing the stations.
+        :rtype: Iterator[Station]
+        """
+
+        for entry in self._station_entries:
+            yield Station.from_dict(entry)
+
+    # The members below work on the decoded JSON directly, so that parsing selectors never
+    # builds Attribute or Station objects.
+
+    @_cached_if_complete
+    def _station_entries(self) -> list[dict]:
         if self.region is None:
-            stations = []
-            for region in BDmep.regions:
-                region_frag = region.upper()
-                path = posixpath.join(st_frag, region_frag)
-                url = urljoin(BDmep.base_apibdmep, path)
-                print(f"DEBUG: GET request: {url}")
-                r = requests.get(url)
-                r.raise_for_status()
-                stations.extend([Station.from_dict(entry) for entry in r.json()])
-            return stations
-
-        region_frag = self.region.upper()
-        path = posixpath.join(st_frag, region_frag)
-        url = urljoin(BDmep.base_apibdmep, path)
-        print(f"DEBUG: GET request: {url}")
-        r = requests.get(url)
-        return [Station.from_dict(entry) for entry in r.json()]
-
-    def _attributes_has_code(self, code: str) -> bool:
-        if code in [attr.code for attr in self.attributes]:
-            return True
-        else:
-            return False
-
-    def _stations_has_code(self, code: str) -> bool:
-        if code in [st.code for st in self.stations]:
-            return True
-        else:
-            return False
+            st_types = [self.st_type] * len(BDmep.regions)
+            with ThreadPoolExecutor(max_workers=len(BDmep.regions)) as executor:
+                responses = list(executor.map(BDmep._query_region_or_none, st_types, BDmep.regions))
+            self._skipped_regions = [
+                region for region, entries in zip(BDmep.regions, responses) if entries is None
+            ]
+            return list(chain.from_iterable(entries or [] for entries in responses))
+
+        return BDmep._query_region(self.st_type, self.region)
+
+    @cached_property
+    def _attr_entries(self) -> list[dict]:
+        return BDmep._query_attrs(self.freq, self.st_type)
+
+    @cached_property
+    def _attr_codes(self) -> frozenset[str]:
+        return frozenset(entry["CODIGO"] for entry in self._attr_entries)
+
+    @_cached_if_complete
+    def _st_index(self) -> tuple[frozenset[str], dict[tuple[str, str], list[str]]]:
+        # Station codes, and (state, unaccented city) -> codes of the stations in that city. Both
+        # are built from one read of _station_entries, which is refetched while regions are skipped.
+        entries = self._station_entries
+        by_city_state = {}
+        for entry in entries:
+            key = (entry["SG_ESTADO"], _to_ascii(entry["DC_NOME"]).upper())
+            by_city_state.setdefault(key, []).append(entry["CD_ESTACAO"])
+        return frozenset(entry["CD_ESTACAO"] for entry in entries), by_city_state
+
+    @staticmethod
+    def _city_state_codes(
+        selector: str, by_city_state: dict[tuple[str, str], list[str]]
+    ) -> list[str] or None:
+        if match := _CITY_STATE_RE.match(selector):
+            key = (match.group(2).upper().strip(), match.group(1).upper().strip())
+            return by_city_state.get(key)
+        return None
+
+    @staticmethod
+    def _query_attrs(freq: str, st_type: str) -> list[dict]:
+        st_frag = "A301" if st_type == "automatic" else "83377"
+        return _get_json(f"{BDmep.base_apitempo}{st_frag}/{freq.upper()}")
+
+    @staticmethod
+    def _query_region(st_type: str, region: str) -> list[dict]:
+        st_frag = "T/R" if st_type == "automatic" else "M/R"
+        return _get_json(f"{BDmep.base_apibdmep}{st_frag}/{region.upper()}")
+
+    @staticmethod
+    def _query_region_or_none(st_type: str, region: str) -> list[dict] or None:
+        # A malformed response from one region shouldn't abort a nationwide query. The failure
+        # is logged by _get_json, isn't memoized and is evicted from the HTTP cache, and the
+        # instance doesn't keep the partial result, so the next access retries the region.
+        try:
+            return BDmep._query_region(st_type, region)
+        except ValueError:
+            return None
 
     def _parse_attrs(self, attr_selector: list[str]) -> list[str]:
         if attr_selector == "all":
-            return [attr.code for attr in self.attributes]
+            return [entry["CODIGO"] for entry in self._attr_entries]
 
+        # Empty for station types without aliases (conventional)
+        aliases = {
+            row.alias: row.code for row in AttrAliases.lookup(freq=self.freq, st_type=self.st_type)
+        }
         attributes = []
+        unresolved = []
         for sel in attr_selector:
-            # If an attribute code is given
-            if re.match(r"I\d{3}", sel, flags=re.I) and self._attributes_has_code(code=sel):
-                attributes.append(sel)
             # If an attribute alias is given
-            elif code := AttrAliases.lookup_code_by_alias(sel, self.freq, self.st_type):
+            if code := aliases.get(sel):
                 attributes.append(code)
+            # If an attribute code is given
+            elif _ATTR_CODE_RE.match(sel) and sel in self._attr_codes:
+                attributes.append(sel)
             else:
-                raise ValueError(
-                    f"Parameter attr_selector given doesn't correspond to any attribute."
-                )
+                unresolved.append(sel)
+        if unresolved:
+            raise ValueError(
+                f"Parameter attr_selector given doesn't correspond to any attribute: {unresolved}"
+            )
         return attributes
         # TODO: Match other parameters.
-        # TODO: Check if it is an alias first.
 
     def _parse_sts(self, st_selector: list[str]) -> list[str]:
         if st_selector == "all":
-            return [st.code for st in self.stations]
+            return [entry["CD_ESTACAO"] for entry in self._station_entries]
 
+        st_codes, by_city_state = self._st_index
         stations = []
+        unresolved = []
         for sel in st_selector:
-            sel = unidecode(sel)
+            normalized = _to_ascii(sel)
             # If a station code is given
-            if re.match(r"[A-Z]\d{3}", sel, flags=re.I) and self._stations_has_code(code=sel):
-                stations.append(sel)
+            if _ST_CODE_RE.match(normalized) and normalized in st_codes:
+                stations.append(normalized)
             # If a station city-state is given
-            elif match := re.match(r"^([ a-z]+)[^a-z]?([A-Z]{2})$", sel, flags=re.I):
-                stations.append(
-                    [
-                        st.code
-                        for st in self.stations
-                        if st.state == match.group(2).upper().strip()
-                        and st.city == match.group(1).upper().strip()
-                    ]
-                )
+            elif codes := BDmep._city_state_codes(normalized, by_city_state):
+                stations.extend(codes)
             else:
-                raise ValueError(f"Parameter st_selector given doesn't correspond to any station.")
+                unresolved.append(sel)
+        if unresolved:
+            message = f"Parameter st_selector given doesn't correspond to any station: {unresolved}"
+            if self._skipped_regions:
+                message += (
+                    f". Regions skipped because of invalid API responses: {self._skipped_regions}"
+                )
+            raise ValueError(message)
+        return stations
 
         # TODO: Match other parameters.
         # TODO: Check if it is an alias first.
@@ -6,6 +6,9 @@ from enum import Enum
 from enum import unique
 from collections import namedtuple
 
+#: Row yielded by AttrAliases.unpack and returned by AttrAliases.lookup.
+AliasRow = namedtuple("AliasRow", ["code", "alias", "freq", "st_type"])
+
 
 @unique
 class AttrAliases(Enum):
@@ -40,10 +43,7 @@ class AttrAliases(Enum):
 
     @classmethod
     def unpack(cls) -> namedtuple:
-        for code, t in cls.__members__.items():
-            alias, freq, st_type = t.value
-            A = namedtuple("A", ["code", "alias", "freq", "st_type"])
-            yield A(code, alias, freq, st_type)
+        yield from _ALIAS_TABLE
 
     @classmethod
     def lookup(
@@ -56,8 +56,13 @@ class AttrAliases(Enum):
             parameters are None then a list with all members of the enum is returned.
         """
 
+        if freq is not None and st_type is not None:
+            members = _ALIASES_BY_FREQ_TYPE.get((freq, st_type), ())
+        else:
+            members = _ALIAS_TABLE
+
         res = []
-        for member in cls.unpack():
+        for member in members:
             if freq == member.freq or freq is None:
                 if st_type == member.st_type or st_type is None:
                     if alias == member.alias or alias is None:
@@ -69,21 +74,25 @@ class AttrAliases(Enum):
     @staticmethod
     def lookup_code_by_alias(alias: str, freq: str, st_type: str) -> str or None:
         """Lookup a single code by alias, freq and st_type"""
-        try:
-            return AttrAliases((alias, freq, st_type)).name
-        except ValueError:
-            return None
+        return _CODE_BY_ALIAS.get((alias, freq, st_type))
 
     @staticmethod
     def lookup_alias_by_code(code: str) -> str or None:
         """Lookup a single alias by code."""
-        try:
-            return AttrAliases[code].name
-        except KeyError:
-            return None
+        return _ALIAS_BY_CODE.get(code)
+
 
+# Tables derived from AttrAliases once at import time
+_ALIAS_TABLE = tuple(AliasRow(member.name, *member.value) for member in AttrAliases)
+_CODE_BY_ALIAS = {(row.alias, row.freq, row.st_type): row.code for row in _ALIAS_TABLE}
+_ALIAS_BY_CODE = {row.code: row.alias for row in _ALIAS_TABLE}
+_ALIASES_BY_FREQ_TYPE = {}
+for _row in _ALIAS_TABLE:
+    _ALIASES_BY_FREQ_TYPE.setdefault((_row.freq, _row.st_type), []).append(_row)
+del _row
 
-@dataclass
+
+@dataclass(slots=True)
 class Attribute:
     code: str
     freq: str
@@ -102,8 +111,12 @@ class Attribute:
         alias = AttrAliases.lookup_alias_by_code(code)
         return Attribute(code, freq, unit, desc, class_, alias)
 
+    @staticmethod
+    def from_records(json_list: list[dict[str:str]]):
+        return [Attribute.from_dict(json_dict) for json_dict in json_list]
+
 
-@dataclass
+@dataclass(slots=True)
 class Station:
     code: str
     city: str
@@ -178,5 +191,19 @@ class Station:
             attributes,
         )
 
+    @staticmethod
+    def from_records(
+        json_list: list[dict[str:str]],
+        attributes: list[Attribute] = None,
+        date_format: str = None,
+    ):
+        # Each station gets its own copy of attributes, so changing one doesn't change the others
+        return [
+            Station.from_dict(
+                json_dict, list(attributes) if attributes is not None else None, date_format
+            )
+            for json_dict in json_list
+        ]
+
 
 # TODO: Take off attributes list of Attribute from station object?
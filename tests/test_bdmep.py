@@ -1,14 +1,262 @@
+import datetime
+import json
+import os
+import tempfile
 import unittest
+from unittest import mock
+import requests
+from requests.adapters import BaseAdapter
 from bdmep import bdmep
 
 
+def station_entry(code: str, city: str, state: str, region: str) -> dict:
+    return {
+        "CD_ESTACAO": code,
+        "DC_NOME": city,
+        "SG_ESTADO": state,
+        "TP_ESTACAO": "Automatica",
+        "SG_REGION": region,
+        "CD_SITUACAO": "Operante",
+        "SG_ENTIDADE": "INMET",
+        "CD_WSI": "",
+        "CD_OSCAR": "",
+        "VL_LATITUDE": "-15.78944444",
+        "VL_LONGITUDE": "-47.92583332",
+        "VL_ALTITUDE": "1160.96",
+        "DT_INICIO_OPERACAO": "2000-05-07T00:00:00",
+        "DT_FIM_OPERACAO": None,
+    }
+
+
+STATIONS = {
+    "N": [station_entry("A101", "MANAUS", "AM", "N")],
+    "NO": [station_entry("A301", "RECIFE", "PE", "NO")],
+    "S": [station_entry("A801", "PORTO ALEGRE", "RS", "S")],
+    "SU": [station_entry("A701", "SÃO PAULO", "SP", "SU")],
+    "CO": [station_entry("A001", "BRASILIA", "DF", "CO")],
+}
+
+
+ATTRIBUTES = [
+    {
+        "CODIGO": code,
+        "PERIODICIDADE": "H",
+        "UNIDADE": unit,
+        "DESCRICAO": desc,
+        "CLASSE": "",
+    }
+    for code, unit, desc in [
+        ("I175", "mm", "PRECIPITACAO TOTAL, HORARIO"),
+        ("I101", "°C", "TEMPERATURA DO AR - BULBO SECO, HORARIA"),
+        ("I105", "%", "UMIDADE RELATIVA DO AR, HORARIA"),
+    ]
+]
+
+
+def fake_get(url: str, **kwargs) -> mock.Mock:
+    response = mock.Mock(from_cache=True, expires=None)
+    if url.startswith(bdmep.BDmep.base_apitempo):
+        response.content = json.dumps(ATTRIBUTES).encode()
+    else:
+        response.content = json.dumps(STATIONS[url.rsplit("/", 1)[-1]]).encode()
+    return response
+
+
 class TestBDmep(unittest.TestCase):
     def setUp(self) -> None:
-        pass
+        patcher = mock.patch.object(bdmep, "_get_session")
+        self.get = patcher.start().return_value.get
+        self.get.side_effect = fake_get
+        self.addCleanup(patcher.stop)
+        bdmep._json_memo.clear()
 
     def test_bdmep(self):
         pass
 
+    def test_stations_queries_every_region(self):
+        stations = bdmep.BDmep("d", "automatic").stations
+        self.assertEqual(self.get.call_count, len(bdmep.BDmep.regions))
+        self.assertEqual([st.region for st in stations], [r.upper() for r in bdmep.BDmep.regions])
+
+    def test_stations_queries_single_region(self):
+        stations = bdmep.BDmep("d", "automatic", "s").stations
+        self.assertEqual(self.get.call_count, 1)
+        self.assertEqual([st.region for st in stations], ["S"])
+
+    def test_stations_skip_invalid_region(self):
+        def get(url, **kwargs):
+            response = fake_get(url, **kwargs)
+            if url.endswith("/S"):
+                response.content = b"<html>Service Unavailable</html>"
+            return response
+
+        self.get.side_effect = get
+        with self.assertLogs(bdmep.logger, "WARNING"):
+            stations = bdmep.BDmep("d", "automatic").stations
+        self.assertEqual([st.region for st in stations], ["N", "NO", "SU", "CO"])
+
+    def test_skipped_region_is_retried_on_same_instance(self):
+        failing = True
+
+        def get(url, **kwargs):
+            response = fake_get(url, **kwargs)
+            if failing and url.endswith("/S"):
+                response.content = b"<html>Service Unavailable</html>"
+            return response
+
+        self.get.side_effect = get
+        api = bdmep.BDmep("d", "automatic")
+        with self.assertLogs(bdmep.logger, "WARNING"):
+            self.assertNotIn("A801", api._parse_sts("all"))
+        with self.assertLogs(bdmep.logger, "WARNING"), self.assertRaisesRegex(
+            ValueError, r"skipped.*\['s'\]"
+        ):
+            api._parse_sts(["A801"])
+        # One request per region, then only the skipped region again
+        self.assertEqual(self.get.call_count, len(bdmep.BDmep.regions) + 1)
+
+        failing = False
+        self.assertIn("A801", api._parse_sts("all"))
+        self.assertEqual(api.prepare_payload("user@example.com", ["A801"])["estacoes"], ["A801"])
+        self.assertIn("S", [st.region for st in api.stations])
+        self.assertEqual(api._skipped_regions, [])
+        self.assertIs(api.stations, api.stations)
+
+    def test_construction_is_lazy(self):
+        api = bdmep.BDmep("d", "automatic")
+        self.get.assert_not_called()
+        self.assertIs(api.attributes, api.attributes)
+        self.assertIs(api.stations, api.stations)
+
+    def test_stations_are_fetched_once(self):
+        bdmep.BDmep("d", "automatic").stations
+        bdmep.BDmep("h", "Automatic").stations
+        self.assertEqual(self.get.call_count, len(bdmep.BDmep.regions))
+
+    def test_parse_attrs(self):
+        api = bdmep.BDmep("h", "automatic")
+        self.assertEqual(api._parse_attrs(["I101", "rain", "I105"]), ["I101", "I175", "I105"])
+        self.assertEqual(self.get.call_count, 1)
+
+    def test_parse_attrs_without_aliases(self):
+        api = bdmep.BDmep("H", "conventional")
+        self.assertEqual(api._parse_attrs(["I101"]), ["I101"])
+        with self.assertRaises(ValueError):
+            api._parse_attrs(["rain"])
+
+    def test_parse_attrs_all(self):
+        self.assertEqual(
+            bdmep.BDmep("h", "automatic")._parse_attrs("all"), ["I175", "I101", "I105"]
+        )
+
+    def test_parse_attrs_unknown(self):
+        with self.assertRaises(ValueError):
+            bdmep.BDmep("h", "automatic")._parse_attrs(["I999"])
+
+    def test_parse_sts(self):
+        api = bdmep.BDmep("d", "automatic")
+        self.assertEqual(
+            api._parse_sts(["A101", "Porto Alegre-RS", "brasília df", "Sao Paulo/SP"]),
+            ["A101", "A801", "A001", "A701"],
+        )
+        self.assertEqual(self.get.call_count, len(bdmep.BDmep.regions))
+
+    def test_parse_sts_unknown(self):
+        with self.assertRaisesRegex(ValueError, r"\['A999', 'Gotham-SP'\]"):
+            bdmep.BDmep("d", "automatic")._parse_sts(["A999", "A101", "Gotham-SP"])
+
+    def test_parameters_are_normalized(self):
+        api = bdmep.BDmep("D", "Automatic", "SU")
+        self.assertEqual((api.freq, api.st_type, api.region), ("d", "automatic", "su"))
+        with self.assertRaises(ValueError):
+            bdmep.BDmep("y", "automatic")
+
+    def test_prepare_payload_skips_objects(self):
+        api = bdmep.BDmep("h", "automatic", "s")
+        with mock.patch.object(bdmep.Station, "from_dict") as from_dict, mock.patch.object(
+            bdmep.Attribute, "from_dict"
+        ) as attr_from_dict:
+            payload = api.prepare_payload("user@example.com", attr_selector=["rain", "I101"])
+        from_dict.assert_not_called()
+        attr_from_dict.assert_not_called()
+        self.assertEqual(payload["estacoes"], ["A801"])
+        self.assertEqual(payload["variaveis"], ["I175", "I101"])
+        self.assertEqual(payload["tipo_estacao"], "T")
+
+
+class FakeAdapter(BaseAdapter):
+    """Serves the STATIONS fixtures, with an HTML error page for the south region."""
+
+    def __init__(self):
+        super().__init__()
+        self.urls = []
+
+    def send(self, request, **kwargs):
+        self.urls.append(request.url)
+        region = request.url.rsplit("/", 1)[-1]
+        response = requests.Response()
+        response.status_code = 200
+        response.url = request.url
+        response.request = request
+        if region == "S":
+            response._content = b"<html>Service Unavailable</html>"
+        else:
+            response._content = json.dumps(STATIONS[region]).encode()
+        return response
+
+    def close(self):
+        pass
+
+
+class TestHTTPCache(unittest.TestCase):
+    def setUp(self) -> None:
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        session = bdmep._make_session(os.path.join(tmpdir.name, "bdmep"), use_cache_dir=False)
+        self.addCleanup(session.close)
+        self.adapter = FakeAdapter()
+        session.mount(bdmep.BDmep.base_apibdmep, self.adapter)
+        patcher = mock.patch.object(bdmep, "_session", session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        bdmep._json_memo.clear()
+        self.addCleanup(bdmep._json_memo.clear)
+
+    def test_invalid_response_is_not_cached(self):
+        with self.assertLogs(bdmep.logger, "WARNING"):
+            codes = bdmep.BDmep("d", "automatic")._parse_sts("all")
+        self.assertNotIn("A801", codes)
+        self.assertEqual(len(self.adapter.urls), len(bdmep.BDmep.regions))
+
+        bdmep._json_memo.clear()
+        with self.assertLogs(bdmep.logger, "WARNING"):
+            bdmep.BDmep("d", "automatic")._parse_sts("all")
+        # Valid regions come from the disk cache; only the invalid one is requested again.
+        self.assertEqual(
+            self.adapter.urls[len(bdmep.BDmep.regions) :], [f"{bdmep.BDmep.base_apibdmep}T/R/S"]
+        )
+
+    def test_memo_follows_http_cache_expiry(self):
+        url = f"{bdmep.BDmep.base_apibdmep}T/R/N"
+        bdmep._get_json(url)
+        expires, _ = bdmep._json_memo[url]
+        (cached,) = bdmep._session.cache.responses.values()
+        self.assertIsNotNone(expires)
+        self.assertEqual(expires, cached.expires)
+
+        # An expired memo entry goes back to the session (served here from the disk cache).
+        bdmep._json_memo[url] = (datetime.datetime.utcnow(), STATIONS["N"])
+        with mock.patch.object(bdmep._session, "get", wraps=bdmep._session.get) as get:
+            self.assertEqual(bdmep._get_json(url), STATIONS["N"])
+        get.assert_called_once()
+        self.assertEqual(self.adapter.urls, [url])
+
+
+class TestToAscii(unittest.TestCase):
+    def test_to_ascii(self):
+        self.assertEqual(bdmep._to_ascii("São Gonçalo"), "Sao Goncalo")
+        self.assertEqual(bdmep._to_ascii("Ñandú"), "Nandu")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,3 +1,4 @@
+import datetime
 import unittest
 import bdmep.modals
 
@@ -6,6 +7,84 @@ class TestModals(unittest.TestCase):
     def test_something(self):
         pass
 
+    def test_unpack(self):
+        rows = list(bdmep.modals.AttrAliases.unpack())
+        self.assertEqual(len(rows), len(bdmep.modals.AttrAliases))
+        self.assertEqual(rows[0], bdmep.modals.AliasRow("I175", "rain", "h", "automatic"))
+
+    def test_lookup(self):
+        rows = bdmep.modals.AttrAliases.lookup(freq="m", alias="rain")
+        self.assertEqual([row.code for row in rows], ["I209"])
+
+    def test_lookup_by_freq_and_st_type(self):
+        rows = bdmep.modals.AttrAliases.lookup(freq="d", st_type="automatic")
+        self.assertEqual(len(rows), 9)
+        self.assertTrue(all(row.freq == "d" for row in rows))
+        self.assertEqual(bdmep.modals.AttrAliases.lookup(freq="d", st_type="conventional"), [])
+        rows = bdmep.modals.AttrAliases.lookup(freq="h", st_type="automatic", alias="T_max")
+        self.assertEqual([row.code for row in rows], ["I611"])
+
+    def test_lookup_code_by_alias(self):
+        AttrAliases = bdmep.modals.AttrAliases
+        self.assertEqual(AttrAliases.lookup_code_by_alias("rain", "d", "automatic"), "I006")
+        self.assertIsNone(AttrAliases.lookup_code_by_alias("rain", "d", "conventional"))
+
+    def test_lookup_alias_by_code(self):
+        AttrAliases = bdmep.modals.AttrAliases
+        self.assertEqual(AttrAliases.lookup_alias_by_code("I006"), "rain")
+        self.assertIsNone(AttrAliases.lookup_alias_by_code("I999"))
+
+    def test_attribute_from_records(self):
+        records = [
+            {
+                "CODIGO": "I175",
+                "PERIODICIDADE": "H",
+                "UNIDADE": "mm",
+                "DESCRICAO": "PRECIPITACAO TOTAL, HORARIO",
+                "CLASSE": "",
+            }
+        ]
+        (attribute,) = bdmep.modals.Attribute.from_records(records)
+        self.assertEqual(attribute.code, "I175")
+        self.assertEqual(attribute.alias, "rain")
+        self.assertFalse(hasattr(attribute, "__dict__"))
+
+    def test_station_from_records(self):
+        records = [
+            {
+                "CD_ESTACAO": code,
+                "DC_NOME": "BRASILIA",
+                "SG_ESTADO": "DF",
+                "TP_ESTACAO": "Automatica",
+                "SG_REGION": "CO",
+                "CD_SITUACAO": "Operante",
+                "SG_ENTIDADE": "INMET",
+                "CD_WSI": "",
+                "CD_OSCAR": "",
+                "VL_LATITUDE": "-15.78944444",
+                "VL_LONGITUDE": "-47.92583332",
+                "VL_ALTITUDE": "1160.96",
+                "DT_INICIO_OPERACAO": start,
+                "DT_FIM_OPERACAO": end,
+            }
+            for code, start, end in [
+                ("A001", "07/05/2000", None),
+                ("A002", "01/01/2001", "31/12/2010"),
+            ]
+        ]
+        stations = bdmep.modals.Station.from_records(records, date_format="%d/%m/%Y")
+        self.assertEqual([st.code for st in stations], ["A001", "A002"])
+        self.assertEqual(stations[0].dt_oper_in, datetime.datetime(2000, 5, 7))
+        self.assertIsNone(stations[0].dt_oper_fn)
+        self.assertEqual(stations[1].dt_oper_fn, datetime.datetime(2010, 12, 31))
+        self.assertEqual(stations[0].lat, -15.78944444)
+
+        attributes = []
+        stations = bdmep.modals.Station.from_records(records, attributes, "%d/%m/%Y")
+        stations[0].attributes.append(None)
+        self.assertEqual(stations[1].attributes, [])
+        self.assertEqual(attributes, [])
+
 
 if __name__ == "__main__":
     unittest.main()